@@ -2,32 +2,46 @@ import pandas as pd
 import numpy as np
 import os
 
+import matplotlib
+
+# Agg renders to file markedly faster than the interactive backends and
+# needs no display; opt in for batch/headless runs before pyplot loads
+if os.environ.get("KIDNEY_UAE_HEADLESS"):
+    matplotlib.use("Agg")
+
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
-import seaborn as sns
-from mpl_toolkits.mplot3d import Axes3D
-import plotly.graph_objects as go
-import plotly.offline as pyo
 
+# plotly is imported lazily inside plot_3d_partial_dependence so that
+# loading this module stays cheap for the far more common metric and
+# matplotlib-based plotting calls
 
 from sklearn.metrics import (
     roc_curve,
     auc,
-    brier_score_loss,
     precision_recall_curve,
-    precision_score,
-    recall_score,
-    confusion_matrix,
-    average_precision_score,
 )
 
 from sklearn.inspection import partial_dependence
-from sklearn.calibration import calibration_curve
+from scipy.stats import rankdata
+
+# numba is optional; when present, the AUC rank-sum kernel is jitted
+try:
+    from numba import njit
+
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
 
 ################################################################################
 ################## Custom Functions for CKD_UAE Project ########################
 ################################################################################
 
+# Shared plotting constants, hoisted so the subplot loops below do not
+# rebuild a formatter and color list on every iteration
+_PCT_FMT = plt.FuncFormatter(lambda y, _: f"{y:.2f}")
+_BAR_COLORS = ["#00BFC4", "#F8766D"]
+
 
 # Function to move a column to be immediately to the left of another column
 def move_column_before(df, target_column, before_column):
@@ -72,8 +86,10 @@ def move_column_before(df, target_column, before_column):
     # Insert the target column back into the list at the new position
     cols.insert(before_column_index, target_column)
 
-    # Reindex the DataFrame with the new column order
-    return df[cols]
+    # Reindex the DataFrame with the new column order; copy=False lets
+    # pandas reuse the existing column blocks instead of copying every
+    # column just to relabel the axis
+    return df.reindex(columns=cols, copy=False)
 
 
 ################################################################################
@@ -145,33 +161,41 @@ def crosstab_plot(
         if crosstab_option:
             # Set a fixed number of ticks for raw data
             ax.set_ylabel("Frequency"),
-            crosstab_data = pd.crosstab(df["outcome"], df[item])
+            # groupby().size().unstack() avoids crosstab's intermediate
+            # pivot construction; observed=True skips empty Categorical cells
+            crosstab_data = (
+                df.groupby(["outcome", item], observed=True)
+                .size()
+                .unstack(item, fill_value=0)
+            )
             crosstab_data.plot(
                 kind="bar",
                 stacked=True,
                 rot=0,
                 ax=ax,
-                color=["#00BFC4", "#F8766D"],
+                color=_BAR_COLORS,
             )
 
         else:
             # Set a fixed number of ticks for percentage data
-            ax.yaxis.set_major_formatter(
-                plt.FuncFormatter(lambda y, _: "{:.2f}".format(y))
-            )
+            ax.yaxis.set_major_formatter(_PCT_FMT)
             ax.set_ylabel("Percentage"),
-            # Computing normalized crosstabulation
-            crosstab_data = pd.crosstab(
-                df["outcome"],
-                df[item],
-                normalize="index",
+            # Computing normalized crosstabulation by dividing the raw
+            # counts by their row totals (cheaper than normalize='index')
+            crosstab_data = (
+                df.groupby(["outcome", item], observed=True)
+                .size()
+                .unstack(item, fill_value=0)
+            )
+            crosstab_data = crosstab_data.div(
+                crosstab_data.sum(axis=1).to_numpy()[:, None]
             )
             crosstab_data.plot(
                 kind="bar",
                 stacked=True,
                 rot=0,
                 ax=ax,
-                color=["#00BFC4", "#F8766D"],
+                color=_BAR_COLORS,
             )
 
         new_labels = [label1, label2]
@@ -186,7 +210,7 @@ def crosstab_plot(
             legend_labels = [item1, item2]
         else:
             # Dynamically setting legend labels for other columns
-            legend_labels = ["No {}".format(item), "{}".format(item)]
+            legend_labels = [f"No {item}", f"{item}"]
 
         # Updating legend with custom labels
         handles, _ = ax.get_legend_handles_labels()
@@ -201,7 +225,9 @@ def crosstab_plot(
     plt.tight_layout(w_pad=w_pad, h_pad=h_pad)
     if image_path and string:
         plt.savefig(os.path.join(image_path, string))
-    plt.show()
+        plt.close(fig)  # free the figure's backing buffers when batch-saving
+    else:
+        plt.show()
 
 
 ################################################################################
@@ -268,12 +294,15 @@ def stacked_plot(
     - The function automatically handles the layout and spacing of the subplots
       to prevent overlap.
     """
-    # Setting custom order if provided
+    # Setting custom order if provided; the ordered Categorical flows
+    # through the groupby index, so no sort of the caller's data is needed
+    col_series = df[col]
     if custom_order:
-        df[col] = pd.Categorical(df[col], categories=custom_order, ordered=True)
-        df.sort_values(
-            by=col, inplace=True
-        )  # Ensure the DataFrame respects the custom ordering
+        col_series = pd.Series(
+            pd.Categorical(col_series, categories=custom_order, ordered=True),
+            index=df.index,
+            name=col,
+        )
 
     fig, axes = plt.subplots(nrows=2, ncols=1, figsize=(x, y))
     fig.tight_layout(w_pad=5, pad=p, h_pad=5)
@@ -283,10 +312,23 @@ def stacked_plot(
     )
 
     # Crosstabulation of column of interest and ground truth
-    crosstabdest = pd.crosstab(df[col], df[truth])
+    crosstabdest = (
+        df.groupby([col_series, df[truth]], observed=True)
+        .size()
+        .unstack(truth, fill_value=0)
+    )
 
-    # Normalized crosstabulation
-    crosstabdestnorm = crosstabdest.div(crosstabdest.sum(1), axis=0)
+    # Normalize in place on the extracted count buffer; np.divide's out
+    # parameter skips the intermediate frame pandas division would
+    # allocate, and the where-mask leaves all-zero rows untouched
+    counts = crosstabdest.to_numpy(dtype=np.float64)
+    row_sums = counts.sum(axis=1, keepdims=True)
+    np.divide(counts, row_sums, out=counts, where=row_sums != 0)
+    crosstabdestnorm = pd.DataFrame(
+        counts,
+        index=crosstabdest.index,
+        columns=crosstabdest.columns,
+    )
 
     title1 = f"{string} by {truth.capitalize()}"
     title2 = f"{string} by {truth.capitalize()} (Normalized)"
@@ -300,7 +342,7 @@ def stacked_plot(
         stacked=True,
         title=title1,
         ax=axes[0],
-        color=["#00BFC4", "#F8766D"],
+        color=_BAR_COLORS,
         width=width,
         rot=rot,
         fontsize=12,
@@ -317,7 +359,7 @@ def stacked_plot(
         title=title2,
         ylabel="Frequency",
         ax=axes[1],
-        color=["#00BFC4", "#F8766D"],
+        color=_BAR_COLORS,
         width=width,
         rot=rot,
         fontsize=12,
@@ -330,7 +372,9 @@ def stacked_plot(
     fig.align_ylabels()
     if image_path and img_string:
         plt.savefig(os.path.join(image_path, img_string))
-    plt.show()
+        plt.close(fig)
+    else:
+        plt.show()
 
 
 ################################################################################
@@ -369,34 +413,60 @@ def plot_roc_curves_by_category(
     plt.xlabel("False Positive Rate")
     plt.ylabel("True Positive Rate")
 
-    categories = X_test[feature].unique()
-    for category in categories:
-        if category in category_labels:
-            # Filter y_test and predictions by the current category
-            category_filter = (X_test[feature] == category).values
-            y_test_filtered = y_test[category_filter]
-            predictions_filtered = predictions[category_filter]
+    # Factorize the stratifying feature once; sorting the small integer
+    # codes replaces per-category equality scans over the raw column
+    cat = pd.Categorical(X_test[feature])
+    codes = cat.codes
+    y = np.asarray(y_test[outcome])
+    preds = np.asarray(predictions)
+
+    order = np.argsort(codes, kind="stable")
+    codes_s, y_s, preds_s = codes[order], y[order], preds[order]
+
+    # Group boundaries within the sorted codes; missing values code to -1
+    # and land before splits[0], so they are excluded from every slice
+    splits = np.searchsorted(codes_s, np.arange(len(cat.categories) + 1))
+
+    for k, category in enumerate(cat.categories):
+        if category in category_labels and splits[k] < splits[k + 1]:
+            # Contiguous views for the current category
+            y_slice = y_s[splits[k]:splits[k + 1]]
+            preds_slice = preds_s[splits[k]:splits[k + 1]]
 
             # Compute ROC curve and ROC area
-            fpr, tpr, _ = roc_curve(y_test_filtered, predictions_filtered)
+            fpr, tpr, _ = roc_curve(y_slice, preds_slice)
             roc_auc = auc(fpr, tpr)
 
+            # Decimate dense curves before plotting; Line2D rendering is
+            # linear in point count, and ~2000 points is visually lossless
+            # (the AUC above is computed from the full arrays)
+            if len(fpr) > 2000:
+                idx = np.unique(np.linspace(0, len(fpr) - 1, 2000).astype(np.int64))
+                fpr, tpr = fpr[idx], tpr[idx]
+
+            # Class counts without building a value_counts hash table
+            counts = np.bincount(y_slice.astype(np.int8), minlength=2)
+            h0, h1 = int(counts[0]), int(counts[1])
+
             # Plot the ROC curve using the custom label
             plt.plot(
                 fpr,
                 tpr,
                 label=(
                     f"{category_labels[category]}, "
-                    f"count = {len(y_test_filtered)}, "
-                    f"$H_0$ = {y_test_filtered[outcome].value_counts()[0]}, "
-                    f"$H_1$ = {y_test_filtered[outcome].value_counts()[1]}, "
+                    f"count = {len(y_slice)}, "
+                    f"$H_0$ = {h0}, "
+                    f"$H_1$ = {h1}, "
                     f"(AUC = {roc_auc:.2f})"
                 ),
             )
 
     plt.legend(loc="lower right")
-    plt.savefig(os.path.join(image_path, img_string))
-    plt.show()
+    if image_path and img_string:
+        plt.savefig(os.path.join(image_path, img_string))
+        plt.close()
+    else:
+        plt.show()
 
 
 ################################################################################
@@ -429,19 +499,31 @@ def plot_calibration_curves(
     - brier_scores: dict, a dictionary of Brier scores for the models
     """
 
-    # Calculate Brier scores for each model
-    brier_scores = {
-        name: brier_score_loss(y_true, proba) for name, proba in model_dict.items()
-    }
+    y_true_arr = np.ascontiguousarray(np.asarray(y_true), dtype=np.float64)
+
+    brier_scores = {}
 
     # Set up the figure
     plt.figure(figsize=figsize)
 
-    # Generate and plot calibration curves
+    # Compute the Brier score and the uniform-bin calibration curve for
+    # each model in a single pass over its probabilities
     for name, proba in model_dict.items():
-        prob_true, prob_pred = calibration_curve(
-            y_true, proba, n_bins=n_bins, strategy="uniform"
-        )
+        proba_arr = np.ascontiguousarray(proba, dtype=np.float64)
+
+        # Brier score as the mean squared residual on the same buffer
+        resid = proba_arr - y_true_arr
+        brier_scores[name] = float(np.dot(resid, resid) / len(resid))
+
+        # Uniform bins accumulated with bincount; no sort required
+        bins = np.clip((proba_arr * n_bins).astype(np.int32), 0, n_bins - 1)
+        count = np.bincount(bins, minlength=n_bins)
+        sum_y = np.bincount(bins, weights=y_true_arr, minlength=n_bins)
+        sum_p = np.bincount(bins, weights=proba_arr, minlength=n_bins)
+        nonempty = count > 0
+        prob_true = sum_y[nonempty] / count[nonempty]
+        prob_pred = sum_p[nonempty] / count[nonempty]
+
         plt.plot(
             prob_pred,
             prob_true,
@@ -458,9 +540,12 @@ def plot_calibration_curves(
     plt.title("Calibration Plots (Reliability Curves)")
     plt.legend()
 
-    plt.savefig(os.path.join(image_path, img_string))
-    # Display the plot
-    plt.show()
+    if image_path and img_string:
+        plt.savefig(os.path.join(image_path, img_string))
+        plt.close()
+    else:
+        # Display the plot
+        plt.show()
 
     return brier_scores
 
@@ -470,6 +555,82 @@ def plot_calibration_curves(
 ################################################################################
 
 
+def _rank_sum_positives(y_true, y_score):
+    """
+    Sums the average ranks of the positive class in a single sorted walk.
+
+    Equal-score runs share the average of their ranks, matching
+    scipy.stats.rankdata(method='average'). Written as one loop so numba
+    can compile it without numpy-dispatch overhead; also valid (if slow)
+    as plain Python.
+
+    Parameters:
+    - y_true: 1D array of binary labels (0/1)
+    - y_score: 1D array of scores, same length as y_true
+
+    Returns:
+    - float: the sum of average ranks over the positive samples
+    """
+    order = np.argsort(y_score)
+    n = y_score.shape[0]
+    rank_sum = 0.0
+    i = 0
+    while i < n:
+        # Extend j to the end of the current run of tied scores
+        j = i
+        while j + 1 < n and y_score[order[j + 1]] == y_score[order[i]]:
+            j += 1
+        avg_rank = 0.5 * (i + j) + 1.0
+        for k in range(i, j + 1):
+            if y_true[order[k]] == 1:
+                rank_sum += avg_rank
+        i = j + 1
+    return rank_sum
+
+
+if _HAS_NUMBA:
+    _rank_sum_positives = njit(cache=True, fastmath=True)(_rank_sum_positives)
+
+
+def _fast_binary_roc_auc(y_true, y_score):
+    """
+    Computes the binary ROC AUC directly from the Mann-Whitney U statistic,
+    bypassing sklearn's roc_curve threshold construction entirely.
+
+    The AUC equals the probability that a randomly chosen positive is scored
+    above a randomly chosen negative, which follows from the rank-sum identity
+    (ranks[pos].sum() - n_pos*(n_pos+1)/2) / (n_pos*n_neg). Ties are handled
+    by average ranks, matching the trapezoidal roc_curve + auc result.
+
+    Parameters:
+    - y_true: array-like, true binary labels (0/1)
+    - y_score: array-like, predicted probabilities or decision scores
+
+    Returns:
+    - float: the ROC AUC, or np.nan if only one class is present
+    """
+    y_true = np.asarray(y_true)
+    y_score = np.asarray(y_score)
+
+    n_pos = int(y_true.sum())
+    n_neg = y_true.shape[0] - n_pos
+    if n_pos == 0 or n_neg == 0:
+        return np.nan
+
+    # Average ranks handle tied scores; a single O(n log n) pass either
+    # through the jitted kernel or scipy's rankdata
+    if _HAS_NUMBA:
+        rank_sum_pos = _rank_sum_positives(
+            np.ascontiguousarray(y_true),
+            np.ascontiguousarray(y_score, dtype=np.float64),
+        )
+    else:
+        ranks = rankdata(y_score, method="average")
+        rank_sum_pos = ranks[y_true == 1].sum()
+
+    return (rank_sum_pos - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+
+
 def evaluate_model_metrics(y_test, model_dict, threshold=0.5):
     """
     Evaluates various performance metrics for a given set of models and compiles
@@ -498,30 +659,60 @@ def evaluate_model_metrics(y_test, model_dict, threshold=0.5):
         "Brier Score": [],
     }
 
-    # Evaluate metrics for each model
-    for name, proba in model_dict.items():
-        # ROC AUC
-        fpr, tpr, _ = roc_curve(y_test, proba)
-        roc_auc = auc(fpr, tpr)
+    # Coerce the ground truth once up front; every sklearn call below would
+    # otherwise re-validate and re-convert the same input per model
+    y_true_arr = np.ascontiguousarray(np.asarray(y_test)).astype(
+        np.int8, copy=False
+    )
+    n_pos = int(y_true_arr.sum())
+    n_neg = len(y_true_arr) - n_pos
+    y_bool = y_true_arr.astype(bool)
+
+    # Stack all models' probabilities into one contiguous (n_models, n)
+    # matrix so the thresholded and squared-error metrics run as broadcast
+    # passes over every model at once instead of per-model Python loops
+    names = list(model_dict.keys())
+    proba_matrix = np.ascontiguousarray(
+        np.stack(
+            [np.asarray(proba, dtype=np.float32) for proba in model_dict.values()]
+        )
+    )
 
-        # PR AUC
-        precision, recall, _ = precision_recall_curve(y_test, proba)
-        pr_auc = auc(recall, precision)
+    # Confusion counts for all models from one broadcast comparison
+    predicted = proba_matrix > threshold
+    tp_all = (predicted & y_bool[None, :]).sum(axis=1)
+    fp_all = predicted.sum(axis=1) - tp_all
 
-        # Predicted labels based on the specified threshold
-        predicted_labels = np.where(proba > threshold, 1, 0)
+    # Brier scores for all models in a single SIMD-friendly sweep
+    # (accumulated in float64 to avoid float32 rounding in the mean)
+    resid = proba_matrix - y_true_arr.astype(np.float32)[None, :]
+    brier_all = (resid * resid).mean(axis=1, dtype=np.float64)
 
-        # Precision, Recall, and Specificity
-        model_precision = precision_score(y_test, predicted_labels)
-        model_recall = recall_score(y_test, predicted_labels)
-        tn, fp, _, _ = confusion_matrix(y_test, predicted_labels).ravel()
-        model_specificity = tn / (tn + fp)
+    # Evaluate the rank-based metrics for each model
+    for i, name in enumerate(names):
+        proba_arr = proba_matrix[i]
 
-        # Average Precision
-        avg_precision = average_precision_score(y_test, proba)
+        # ROC AUC via the rank-sum identity (avoids roc_curve's threshold
+        # deduplication and curve construction)
+        roc_auc = _fast_binary_roc_auc(y_true_arr, proba_arr)
+
+        # PR AUC and Average Precision from one precision-recall sweep;
+        # average_precision_score would redo the same sort over proba
+        precision, recall, _ = precision_recall_curve(y_true_arr, proba_arr)
+        pr_auc = auc(recall, precision)
+        avg_precision = -np.sum(np.diff(recall) * precision[:-1])
+
+        # Precision, Recall, and Specificity from the batched counts
+        tp = int(tp_all[i])
+        fp = int(fp_all[i])
+        fn = n_pos - tp
+        tn = n_neg - fp
+        model_precision = tp / (tp + fp) if (tp + fp) else 0.0
+        model_recall = tp / (tp + fn) if (tp + fn) else 0.0
+        model_specificity = tn / (tn + fp) if (tn + fp) else 0.0
 
         # Brier Score
-        brier_score = brier_score_loss(y_test, proba)
+        brier_score = float(brier_all[i])
 
         # Append metrics
         metrics_dict["Metric"].append(name)
@@ -582,6 +773,8 @@ def plot_3d_partial_dependence(
     matplotlib_colormap="coolwarm",
     plotly_colormap="Viridis",
     zoom_out_factor=None,
+    grid_resolution=20,
+    sample_frac=1.0,
 ):
     """
     Plots a 3D Partial Dependence Plot using Plotly and optionally with Matplotlib.
@@ -607,20 +800,39 @@ def plot_3d_partial_dependence(
     matplotlib_colormap: Adjustable colormap for the static plot
     plotly_colormap: Adjustable colormap for the interactive plot
     zoom_out_factor: Adjustable zoom scaling for interactive plot
+    grid_resolution: Number of grid points per feature axis; the model is
+                     evaluated on grid_resolution**2 replications of the
+                     data, so lowering this (e.g., to 10) cuts cost
+                     quadratically.
+    sample_frac: Optional fraction of rows to subsample (with a fixed
+                 seed) before the partial dependence calculation.
     """
 
     # Identifying the indices of the features of interest
-    feature_indices = [
-        list(dataframe.columns).index(feature_names_list[0]),
-        list(dataframe.columns).index(feature_names_list[1]),
-    ]
+    feature_indices = dataframe.columns.get_indexer(feature_names_list)
+
+    # Optionally subsample the rows (seeded) before the grid sweep; the
+    # model is re-evaluated on every retained row per grid point
+    X_pd = dataframe
+    if sample_frac < 1.0:
+        X_pd = X_pd.sample(frac=sample_frac, random_state=0)
+
+    # Re-materialize the working copy as a single column-major block;
+    # partial_dependence overwrites one column per grid point, so F-order
+    # keeps each sweep contiguous instead of strided across rows
+    X_pd = pd.DataFrame(
+        np.asfortranarray(X_pd.to_numpy()),
+        columns=X_pd.columns,
+        index=X_pd.index,
+        copy=False,
+    )
 
     # Computing the partial dependence
     pdp_results = partial_dependence(
         model,
-        X=dataframe,
+        X=X_pd,
         features=[(feature_indices[0], feature_indices[1])],
-        grid_resolution=20,
+        grid_resolution=grid_resolution,
     )
 
     # Extracting the meshgrid which was used for calculation
@@ -630,6 +842,9 @@ def plot_3d_partial_dependence(
     ZZ = pdp_results["average"][0].reshape(XX.shape)
 
     if interactive:
+        # Deferred so module import does not pay plotly's load time
+        import plotly.graph_objects as go
+
         # Plotly Interactive Plot
         plotly_fig = go.Figure(
             data=[
@@ -683,9 +898,14 @@ def plot_3d_partial_dependence(
         if not os.path.exists(html_file_dir):
             os.makedirs(html_file_dir)
 
-        # Save the HTML file to the specified full path
-        pyo.plot(plotly_fig, filename=full_html_file_path, auto_open=False, 
-                 config={'modeBarButtonsToRemove': ['resetCameraDefault3d']})
+        # Save the HTML file to the specified full path; referencing
+        # plotly.js from the CDN keeps the output at ~KB scale instead of
+        # embedding the multi-MB bundle into every file
+        plotly_fig.write_html(
+            full_html_file_path,
+            include_plotlyjs="cdn",
+            config={"modeBarButtonsToRemove": ["resetCameraDefault3d"]},
+        )
 
         plotly_fig.show()
 